@@ -1,9 +1,23 @@
 #!/usr/bin/env python3
+import io
 import os
+import sys
 import requests
-import statistics
-from datetime import datetime, timedelta, timezone
-from calendar import monthrange
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+import itemid_cache
+from zbx_common import (
+    aggregate_trends,
+    configure,
+    fetch_trends_bulk,
+    format_bps,
+    format_total_bytes,
+    format_utc,
+    intervalo_mes_anterior_utc,
+    intervalo_ultimos_30_dias_utc,
+    zabbix_api,
+)
 
 # =======================
 # CONFIG
@@ -24,84 +38,20 @@ ULTIMOS_30_DIAS = True
 VERIFY_SSL = False
 HTTP_TIMEOUT = 60
 
+# Hosts processados em paralelo (= conexões keep-alive mantidas com o Zabbix)
+MAX_WORKERS = 8
+
+# Validade do cache local de itemids (itemid_cache.py); 0 desativa
+ITEMID_CACHE_TTL = 24 * 3600
+
 # Impressões opcionais
 PRINT_TOTAL = False          # total em Bytes do período (opcional)
 PRINT_P95   = True           # mostrar 95º percentil
-
-# =======================
-# Tempo
-# =======================
-def intervalo_mes_anterior_utc(now_utc: datetime):
-    ano = now_utc.year if now_utc.month > 1 else now_utc.year - 1
-    mes = now_utc.month - 1 if now_utc.month > 1 else 12
-    inicio = datetime(ano, mes, 1, 0, 0, 0, tzinfo=timezone.utc)
-    fim = datetime(ano, mes, monthrange(ano, mes)[1], 23, 59, 59, tzinfo=timezone.utc)
-    return int(inicio.timestamp()), int(fim.timestamp())
-
-def intervalo_ultimos_30_dias_utc(now_utc: datetime):
-    return int((now_utc - timedelta(days=30)).timestamp()), int(now_utc.timestamp())
-
-# =======================
-# API
-# =======================
-def zabbix_api(method, params):
-    payload = {"jsonrpc": "2.0", "method": method, "params": params, "auth": AUTH_TOKEN, "id": 1}
-    r = requests.post(ZABBIX_URL, json=payload, verify=VERIFY_SSL, timeout=HTTP_TIMEOUT)
-    r.raise_for_status()
-    j = r.json()
-    if "error" in j:
-        raise RuntimeError(j["error"])
-    return j["result"]
+EXACT_P95   = False          # True: 95º interpolado; False: nearest-rank (mais barato)
 
 # =======================
 # Helpers
 # =======================
-def format_bps(bps: float) -> str:
-    units = ["bps", "Kbps", "Mbps", "Gbps", "Tbps"]
-    v = float(bps)
-    i = 0
-    while v >= 1000 and i < len(units) - 1:
-        v /= 1000.0
-        i += 1
-    return f"{v:.2f} {units[i]}"
-
-def format_total_bytes(num_bytes: float) -> str:
-    gb = num_bytes / (1024 ** 3)
-    if gb >= 1024:
-        return f"{gb/1024:.2f} TB"
-    return f"{gb:.2f} GB"
-
-def percentile(values, p):
-    if not values:
-        return None
-    vals = sorted(values)
-    k = (len(vals) - 1) * (p / 100.0)
-    f = int(k)
-    c = min(f + 1, len(vals) - 1)
-    if f == c:
-        return vals[f]
-    return vals[f] + (vals[c] - vals[f]) * (k - f)
-
-def fetch_trend_avgs(itemid, t_from, t_till):
-    """Retorna listas (avgs, mins, maxs) apenas para buckets com num>0."""
-    trends = zabbix_api("trend.get", {
-        "output": ["clock", "num", "value_avg", "value_min", "value_max"],
-        "itemids": itemid,
-        "time_from": t_from,
-        "time_till": t_till,
-        "sortfield": "clock",
-        "sortorder": "ASC",
-    })
-    if not trends:
-        return [], [], []
-    buckets = [t for t in trends if int(t.get("num", 0)) > 0]
-    if not buckets:
-        return [], [], []
-    avgs = [float(t["value_avg"]) for t in buckets]  # bits/s
-    mins = [float(t["value_min"]) for t in buckets]
-    maxs = [float(t["value_max"]) for t in buckets]
-    return avgs, mins, maxs
-
 def sanitize_item_name(name: str) -> str:
     """Tenta deixar o nome da interface mais limpo."""
     if not name:
@@ -111,16 +61,159 @@ def sanitize_item_name(name: str) -> str:
             return name.split(sep, 1)[0]
     return name
 
+def item_get_por_keys(host, keys):
+    """item.get só com os campos usados, filtrando pelas key_ exatas."""
+    return zabbix_api("item.get", {
+        "output": ["itemid", "name", "key_"],
+        "host": host,
+        "filter": {"key_": keys},
+    })
+
 # =======================
 # Main
 # =======================
+def preparar_host(host, ifindexes):
+    """
+    Fase 1 (por host, em paralelo): resolve os itemids das interfaces.
+    Retorna (out, ctx) com a saída parcial e o que a fase 3 precisa.
+    """
+    out = io.StringIO()
+    print(f"==================== {host} ====================", file=out)
+
+    # Monta todas as chaves IN/OUT necessárias para este host (usando ifName, sem aspas)
+    keys_needed = []
+    meta_list = []  # (key, ifname, dir)
+
+    for raw_idx in ifindexes:
+        ifname = str(raw_idx)  # garante string (evita misturar int/str)
+        kin = f"SnmpInterfaceInTraffic[{ifname}]"
+        kout = f"SnmpInterfaceOutTraffic[{ifname}]"
+        keys_needed.extend([kin, kout])
+        meta_list.append((kin, ifname, "IN"))
+        meta_list.append((kout, ifname, "OUT"))
+
+    # Resolve itemids (cache local primeiro; item.get só para o que faltar)
+    found = itemid_cache.get(ZABBIX_URL, host, keys_needed, ITEMID_CACHE_TTL)
+    cached = {it["itemid"]: key for key, it in found.items()}  # itemid do cache -> key_
+    pending = [k for k in keys_needed if k not in found]
+    if pending:
+        items = item_get_por_keys(host, pending)
+        itemid_cache.put(ZABBIX_URL, host, items, ITEMID_CACHE_TTL)
+        found.update({it["key_"]: it for it in items})
+    # Impresso só na fase 3: revalidar_cache() ainda pode somar chaves que sumiram
+    missing = [k for k in keys_needed if k not in found]
+
+    # Nome por interface (ifName sempre string)
+    names = {}    # ifName -> nome do item (sanitizado) | None
+    tarefas = []  # (itemid, ifname, direc)
+
+    for key, ifname, direc in meta_list:
+        it = found.get(key)
+        if not names.get(ifname):
+            names[ifname] = sanitize_item_name(it.get("name") or "") if it else None
+        if it:
+            tarefas.append((it["itemid"], ifname, direc))
+    return out, {"host": host, "names": names, "tarefas": tarefas, "cached": cached,
+                 "keys_needed": keys_needed, "missing": missing}
+
+def revalidar_cache(preparados, trends, time_from, time_till):
+    """
+    Fase 2b: itemid vindo do cache sem nenhum bucket pode ter sido removido/recriado
+    no Zabbix (LLD, relink de template) -- trend.get não falha, só volta vazio.
+    Re-resolve só essas chaves com item.get (hosts em paralelo) antes de reportar
+    "sem dados" e busca as trends dos itemids novos; atualiza ctx e trends no lugar.
+    """
+    pendentes = []  # (ctx, { itemid_do_cache: key_ })
+    for _, ctx in preparados:
+        suspeitos = {iid: key for iid, key in ctx["cached"].items() if iid not in trends}
+        if suspeitos:
+            pendentes.append((ctx, suspeitos))
+    if not pendentes:
+        return
+
+    with ThreadPoolExecutor(max_workers=max(1, min(MAX_WORKERS, len(pendentes)))) as ex:
+        respostas = list(ex.map(lambda p: item_get_por_keys(p[0]["host"], list(p[1].values())), pendentes))
+
+    novos = []
+    for (ctx, suspeitos), items in zip(pendentes, respostas):
+        host = ctx["host"]
+        # INSERT OR REPLACE renova as chaves que ainda existem (interface ociosa segue
+        # no cache); só as que o Zabbix não devolve mais saem do cache
+        itemid_cache.put(ZABBIX_URL, host, items, ITEMID_CACHE_TTL)
+        by_key = {it["key_"]: it["itemid"] for it in items}
+        sumidos = [key for key in suspeitos.values() if key not in by_key]
+        itemid_cache.forget(ZABBIX_URL, host, sumidos, ITEMID_CACHE_TTL)
+
+        remap = {iid: by_key.get(key) for iid, key in suspeitos.items() if by_key.get(key) != iid}
+        if remap:
+            # None = chave sumiu: sai das tarefas e entra em "Itens não encontrados"
+            ctx["tarefas"] = [(remap.get(iid, iid), ifname, direc)
+                              for iid, ifname, direc in ctx["tarefas"] if remap.get(iid, iid)]
+            novos.extend(iid for iid in remap.values() if iid)
+        if sumidos:
+            ausentes = set(ctx["missing"]).union(sumidos)
+            ctx["missing"] = [k for k in ctx["keys_needed"] if k in ausentes]
+    if novos:
+        trends.update(fetch_trends_bulk(novos, time_from, time_till))
+
+def imprimir_host(out, ctx, trends):
+    """Fase 3: agrega as trends já baixadas do host e completa a sua saída."""
+    names = ctx["names"]
+    if ctx["missing"]:
+        print("  Itens não encontrados no host:", ctx["missing"], file=out)
+        print("  Verifique se o ifName no HOSTS_IFINDEX corresponde exatamente ao que está no key.\n", file=out)
+
+    # Estatísticas planas por (ifName, direção)
+    stats = {}    # (ifName, "IN"|"OUT") -> { media, min, max, p95, total_bytes }
+    for itemid, ifname, direc in ctx["tarefas"]:
+        resumo = aggregate_trends(trends.get(itemid, []), PRINT_P95, EXACT_P95)
+        if resumo:
+            stats[(ifname, direc)] = resumo
+
+    # Impressão organizada por interface
+    if not names:
+        print("  Nenhum item processado.\n", file=out)
+        return out.getvalue()
+
+    for ifname in sorted(names):  # todas as chaves são str
+        name = names[ifname] or f"{ifname}"
+        din = stats.get((ifname, "IN"))
+        dout = stats.get((ifname, "OUT"))
+        print(f"[ifName {ifname}] {name}", file=out)
+
+        if din:
+            print(f"  Received (IN):", file=out)
+            print(f"    Média: {format_bps(din['media'])}", file=out)
+            print(f"    Mín/Máx horário: {format_bps(din['min'])} | {format_bps(din['max'])}", file=out)
+            if PRINT_P95 and din['p95'] is not None:
+                print(f"    95º percentil: {format_bps(din['p95'])}", file=out)
+            if PRINT_TOTAL:
+                print(f"    Total (opcional): {format_total_bytes(din['total_bytes'])}", file=out)
+        else:
+            print("  Received (IN): sem dados no período.", file=out)
+
+        if dout:
+            print(f"  Send (OUT):", file=out)
+            print(f"    Média: {format_bps(dout['media'])}", file=out)
+            print(f"    Mín/Máx horário: {format_bps(dout['min'])} | {format_bps(dout['max'])}", file=out)
+            if PRINT_P95 and dout['p95'] is not None:
+                print(f"    95º percentil: {format_bps(dout['p95'])}", file=out)
+            if PRINT_TOTAL:
+                print(f"    Total (opcional): {format_total_bytes(dout['total_bytes'])}", file=out)
+        else:
+            print("  Send (OUT): sem dados no período.", file=out)
+
+        if din and dout:
+            media_sum = din['media'] + dout['media']
+            print(f"  Agregado (IN+OUT):", file=out)
+            print(f"    Média: {format_bps(media_sum)}", file=out)
+            if PRINT_P95 and din['p95'] is not None and dout['p95'] is not None:
+                print(f"    95º percentil (aprox.): {format_bps(din['p95'] + dout['p95'])}", file=out)
+        print(file=out)
+    return out.getvalue()
+
 def main():
-    if not VERIFY_SSL:
-        try:
-            import urllib3
-            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-        except Exception:
-            pass
+    configure(ZABBIX_URL, AUTH_TOKEN, verify=VERIFY_SSL, timeout=HTTP_TIMEOUT, pool_size=MAX_WORKERS)
 
     now = datetime.now(timezone.utc)
     if ULTIMOS_30_DIAS:
@@ -128,112 +221,20 @@ def main():
     else:
         time_from, time_till = intervalo_mes_anterior_utc(now)
 
-    print(f"Período: {datetime.utcfromtimestamp(time_from)} UTC até {datetime.utcfromtimestamp(time_till)} UTC\n")
-
-    for host, ifindexes in HOSTS_IFINDEX.items():
-        print(f"==================== {host} ====================")
-
-        # Monta todas as chaves IN/OUT necessárias para este host (usando ifName, sem aspas)
-        keys_needed = []
-        meta_list = []  # (key, ifname, dir)
-
-        for raw_idx in ifindexes:
-            ifname = str(raw_idx)  # garante string (evita misturar int/str)
-            kin = f"SnmpInterfaceInTraffic[{ifname}]"
-            kout = f"SnmpInterfaceOutTraffic[{ifname}]"
-            keys_needed.extend([kin, kout])
-            meta_list.append((kin, ifname, "IN"))
-            meta_list.append((kout, ifname, "OUT"))
-
-        # Resolve itemids
-        items = zabbix_api("item.get", {
-            "output": ["itemid", "name", "key_", "units"],
-            "host": host,
-            "filter": {"key_": keys_needed},
-        })
-        found = {it["key_"]: it for it in items}
-        missing = [k for k in keys_needed if k not in found]
-        if missing:
-            print("  Itens não encontrados no host:", missing)
-            print("  Verifique se o ifName no HOSTS_IFINDEX corresponde exatamente ao que está no key.\n")
-
-        # Agregador por interface (usa ifName como chave, sempre string)
-        by_if = {}  # ifName -> { "name": <auto>, "IN": {...} | None, "OUT": {...} | None }
-
-        for key, ifname, direc in meta_list:
-            it = found.get(key)
-            if not it:
-                by_if.setdefault(ifname, {"name": None, "IN": None, "OUT": None})
-                continue
-
-            itemid = it["itemid"]
-            item_name = sanitize_item_name(it.get("name") or "")
-
-            if ifname not in by_if:
-                by_if[ifname] = {"name": item_name, "IN": None, "OUT": None}
-            else:
-                if not by_if[ifname].get("name"):
-                    by_if[ifname]["name"] = item_name
-
-            avgs, mins, maxs = fetch_trend_avgs(itemid, time_from, time_till)
-            if not avgs:
-                continue
-
-            media_dir = statistics.mean(avgs)
-            min_dir   = min(mins)
-            max_dir   = max(maxs)
-            p95_dir   = percentile(avgs, 95.0) if PRINT_P95 else None
-            total_bits = sum(a * 3600 for a in avgs)  # somatório por bucket de 1h
-
-            by_if[ifname][direc] = {
-                "media": media_dir,
-                "min": min_dir,
-                "max": max_dir,
-                "p95": p95_dir,
-                "total_bytes": total_bits / 8.0,
-            }
-
-        # Impressão organizada por interface
-        if not by_if:
-            print("  Nenhum item processado.\n")
-            continue
-
-        for ifname in sorted(by_if.keys()):  # todas as chaves são str
-            entry = by_if[ifname]
-            name = entry.get("name") or f"{ifname}"
-            din = entry["IN"]
-            dout = entry["OUT"]
-            print(f"[ifName {ifname}] {name}")
-
-            if din:
-                print(f"  Received (IN):")
-                print(f"    Média: {format_bps(din['media'])}")
-                print(f"    Mín/Máx horário: {format_bps(din['min'])} | {format_bps(din['max'])}")
-                if PRINT_P95 and din['p95'] is not None:
-                    print(f"    95º percentil: {format_bps(din['p95'])}")
-                if PRINT_TOTAL:
-                    print(f"    Total (opcional): {format_total_bytes(din['total_bytes'])}")
-            else:
-                print("  Received (IN): sem dados no período.")
-
-            if dout:
-                print(f"  Send (OUT):")
-                print(f"    Média: {format_bps(dout['media'])}")
-                print(f"    Mín/Máx horário: {format_bps(dout['min'])} | {format_bps(dout['max'])}")
-                if PRINT_P95 and dout['p95'] is not None:
-                    print(f"    95º percentil: {format_bps(dout['p95'])}")
-                if PRINT_TOTAL:
-                    print(f"    Total (opcional): {format_total_bytes(dout['total_bytes'])}")
-            else:
-                print("  Send (OUT): sem dados no período.")
-
-            if din and dout:
-                media_sum = din['media'] + dout['media']
-                print(f"  Agregado (IN+OUT):")
-                print(f"    Média: {format_bps(media_sum)}")
-                if PRINT_P95 and din['p95'] is not None and dout['p95'] is not None:
-                    print(f"    95º percentil (aprox.): {format_bps(din['p95'] + dout['p95'])}")
-            print()
+    print(f"Período: {format_utc(time_from)} UTC até {format_utc(time_till)} UTC\n")
+
+    # Fase 1: hosts são independentes -> resolve itemids em paralelo (ordem de HOSTS_IFINDEX)
+    with ThreadPoolExecutor(max_workers=max(1, min(MAX_WORKERS, len(HOSTS_IFINDEX)))) as ex:
+        preparados = list(ex.map(lambda h: preparar_host(h[0], h[1]), HOSTS_IFINDEX.items()))
+
+    # Fase 2: itemid é único no servidor -> uma só trend.get para todos os hosts
+    itemids = [t[0] for _, ctx in preparados for t in ctx["tarefas"]]
+    trends = fetch_trends_bulk(itemids, time_from, time_till)
+    revalidar_cache(preparados, trends, time_from, time_till)
+
+    # Fase 3: agrega e imprime na ordem de HOSTS_IFINDEX
+    for out, ctx in preparados:
+        sys.stdout.write(imprimir_host(out, ctx, trends))
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Cache local (SQLite) do mapeamento host/key_ -> itemid resolvido via item.get.
+
+O mapeamento praticamente não muda entre execuções; com o cache, item.get só
+é chamado para as chaves que ainda não estão no cache ou que expiraram.
+
+O cache é best-effort: qualquer erro do SQLite (arquivo em diretório somente
+leitura, banco corrompido/travado) é ignorado e o chamador segue sem cache.
+"""
+import os
+import sqlite3
+import time
+
+CACHE_PATH = os.getenv(
+    "ZABBIX_ITEMID_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".itemid_cache.sqlite"),
+)
+
+def _connect():
+    # Uma conexão por operação: simples e seguro para uso a partir de threads
+    con = sqlite3.connect(CACHE_PATH, timeout=30)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS itemids (
+            server     TEXT,
+            host       TEXT,
+            key        TEXT,
+            itemid     TEXT,
+            name       TEXT,
+            fetched_at INTEGER,
+            PRIMARY KEY (server, host, key)
+        )
+    """)
+    return con
+
+def get(server, host, keys, ttl):
+    """Retorna { key_: item } (itemid, name, key_) para as chaves ainda válidas no cache."""
+    if ttl <= 0 or not keys:
+        return {}
+    limite = int(time.time()) - ttl
+    found = {}
+    try:
+        con = _connect()
+        try:
+            placeholders = ",".join("?" * len(keys))
+            rows = con.execute(
+                f"SELECT key, itemid, name FROM itemids"
+                f" WHERE server = ? AND host = ? AND fetched_at >= ? AND key IN ({placeholders})",
+                [server, host, limite, *keys],
+            )
+            for key, itemid, name in rows:
+                found[key] = {"itemid": itemid, "name": name, "key_": key}
+        finally:
+            con.close()
+    except sqlite3.Error:
+        return {}  # sem cache: tudo vai para o item.get
+    return found
+
+def put(server, host, items, ttl):
+    """Grava/atualiza os itens retornados pelo item.get (nada com ttl <= 0)."""
+    if ttl <= 0 or not items:
+        return
+    agora = int(time.time())
+    try:
+        con = _connect()
+        try:
+            with con:
+                con.executemany(
+                    "INSERT OR REPLACE INTO itemids VALUES (?, ?, ?, ?, ?, ?)",
+                    [(server, host, it["key_"], it["itemid"], it.get("name"), agora) for it in items],
+                )
+        finally:
+            con.close()
+    except sqlite3.Error:
+        pass
+
+def forget(server, host, keys, ttl):
+    """Remove do cache chaves que o Zabbix não devolve mais (item removido); nada com ttl <= 0."""
+    if ttl <= 0 or not keys:
+        return
+    try:
+        con = _connect()
+        try:
+            with con:
+                con.executemany(
+                    "DELETE FROM itemids WHERE server = ? AND host = ? AND key = ?",
+                    [(server, host, key) for key in keys],
+                )
+        finally:
+            con.close()
+    except sqlite3.Error:
+        pass
@@ -1,7 +1,17 @@
 #!/usr/bin/env python3
+import io
 import os
 import re
+import sys
 import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+try:
+    import orjson  # opcional: serializa/decodifica o JSON (item.get com tags) bem mais rápido
+except ImportError:
+    orjson = None
+from concurrent.futures import ThreadPoolExecutor
 
 # =======================
 # CONFIG
@@ -20,11 +30,16 @@ LABEL_PATTERNS = [
     "transit-EdgeUno",
     "Peering",
 ]
+# (pattern, pattern.lower()) calculado uma vez, não por item
+LABEL_PATTERNS_LOWER = [(p, p.lower()) for p in LABEL_PATTERNS]
 
 VERIFY_SSL = False
 HTTP_TIMEOUT = 60
 MAX_SHOW = 40   # quantos itens detalhar por host
 RAW_SHOW  = 10  # dump inicial de itens crus por família
+MAX_WORKERS = 4 # hosts consultados em paralelo (= conexões keep-alive no pool)
+VERBOSE = True  # False: no match, só os contadores (sem exemplos)
+ITEM_LIMIT = 10000  # teto de itens por família de chave (a API não tem offset para paginar)
 
 # Famílias de chaves a procurar (SNMP e Agent)
 KEY_FAMILIES = [
@@ -36,166 +51,209 @@ KEY_FAMILIES = [
 # =======================
 # API helper
 # =======================
+# Sessão única: reaproveita as conexões TCP/TLS entre chamadas (keep-alive).
+# Só chamamos métodos *.get (idempotentes), então o POST pode ser repetido em 502/503/504.
+try:
+    _RETRY = Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504],
+                   allowed_methods=frozenset({"POST"}))
+except TypeError:
+    # urllib3 < 1.26: o mesmo parâmetro ainda se chama method_whitelist
+    _RETRY = Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504],
+                   method_whitelist=frozenset({"POST"}))
+
+SESSION = requests.Session()
+_ADAPTER = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS, max_retries=_RETRY)
+SESSION.mount("http://", _ADAPTER)
+SESSION.mount("https://", _ADAPTER)
+SESSION.headers.update({"Content-Type": "application/json"})
+SESSION.verify = VERIFY_SSL
+
+if not VERIFY_SSL:
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
 def api(method, params):
     payload = {"jsonrpc": "2.0", "method": method, "params": params, "auth": AUTH_TOKEN, "id": 1}
-    r = requests.post(ZABBIX_URL, json=payload, verify=VERIFY_SSL, timeout=HTTP_TIMEOUT)
+    if orjson:
+        # Content-Type já vem dos headers da SESSION
+        r = SESSION.post(ZABBIX_URL, data=orjson.dumps(payload), timeout=HTTP_TIMEOUT)
+    else:
+        r = SESSION.post(ZABBIX_URL, json=payload, timeout=HTTP_TIMEOUT)
     r.raise_for_status()
-    j = r.json()
+    j = orjson.loads(r.content) if orjson else r.json()
     if "error" in j:
         raise RuntimeError(j["error"])
     return j["result"]
 
-def idx_from_key(key_):
-    # "[12]" ou ".12]"
-    m = re.search(r'\[(\d+)\]$', key_)
-    if m:
-        return int(m.group(1))
-    m2 = re.search(r'\.(\d+)\]$', key_)
-    return int(m2.group(1)) if m2 else None
+_IDX_RE = re.compile(r'[\[.](\d+)\]$')
+
+def idx_from_key(key_, _m=_IDX_RE.search):
+    # "[12]" ou ".12]" numa única busca; _m = método já resolvido (lookup local)
+    m = _m(key_)
+    return int(m.group(1)) if m else None
 
 def coletar_itens_iface_com_tags(host):
+    # Um único item.get para todas as famílias (searchByAny = OR entre os valores)
+    params = {
+        "output": ["itemid", "name", "key_"],
+        "host": host,
+        "search": {"key_": KEY_FAMILIES},
+        "searchByAny": True,
+        "searchWildcardsEnabled": True,
+        "limit": ITEM_LIMIT * len(KEY_FAMILIES),  # mesma capacidade de 1 item.get por família
+        "sortfield": "name",
+    }
+    # TAGS só são usadas no detalhe (MAX_SHOW) e no match; sem nenhum dos dois, não pede
+    if LABEL_PATTERNS or MAX_SHOW:
+        params["selectTags"] = ["tag", "value"]   # <- pega TAGS
+    items = api("item.get", params)
+
+    # Reagrupa por família (ordem de KEY_FAMILIES, por nome dentro de cada uma);
+    # o search do Zabbix não diferencia maiúsculas. O regrupamento precisa da
+    # resposta inteira, então ela é decodificada de uma vez (limitada pelo "limit" acima).
+    keys_l = [(it, it.get("key_","").lower()) for it in items]
     items_all = []
     raw_debug = []
     for fam in KEY_FAMILIES:
-        items = api("item.get", {
-            "output": ["itemid", "name", "key_"],
-            "host": host,
-            "search": {"key_": fam},
-            "searchWildcardsEnabled": True,
-            "limit": 10000,
-            "sortfield": "name",
-            "selectTags": ["tag", "value"],   # <- pega TAGS
-        })
-        items_all.extend(items)
-        raw_debug.extend((it.get("key_",""), it.get("name","")) for it in items[:RAW_SHOW])
-
-    # dedup por itemid só por segurança
+        fam_l = fam.lower()
+        fam_items = [it for it, k in keys_l if fam_l in k]
+        items_all.extend(fam_items)
+        if RAW_SHOW:  # RAW_SHOW = 0 desliga a amostra crua
+            raw_debug.extend((it.get("key_",""), it.get("name","")) for it in fam_items[:RAW_SHOW])
+
+    # dedup por itemid só por segurança; já anexa ifIndex/nome/tags normalizados
+    # (_idx, _name, _tags) para os loops seguintes não repetirem regex nem .get
     seen = set()
     dedup = []
     for it in items_all:
         iid = it.get("itemid")
         if iid not in seen:
             seen.add(iid)
+            it["_idx"] = idx_from_key(it.get("key_","")) or "-"
+            it["_name"] = it.get("name","")
+            it["_tags"] = it.get("tags") or ()
             dedup.append(it)
     return dedup, raw_debug
 
 def tags_to_str(tags):
     if not tags:
         return "-"
-    return ", ".join(f"{t.get('tag','')}: {t.get('value','')}" for t in tags)
+    # lista (não gerador): join pré-dimensiona o resultado; "tag"/"value" sempre presentes
+    return ", ".join([f"{t['tag']}: {t['value']}" for t in tags])
 
-def match_patterns(name, tags, patterns):
-    textblocks = [name or ""]
+def match_patterns(name, tags, patterns_lower):
     if tags:
-        textblocks.extend([t.get("tag",""), t.get("value","")] for t in tags)
-        # flatten
-        flat = []
-        for x in textblocks:
-            if isinstance(x, list):
-                flat.extend(x)
-            else:
-                flat.append(x)
-        text = " | ".join(flat).lower()
+        # "name | tag | value | ..." montado numa passada, um único lower()
+        # selectTags sempre devolve "tag" e "value": indexação direta
+        parts = [name or ""]
+        append = parts.append
+        for t in tags:
+            append(t["tag"])
+            append(t["value"])
+        text = " | ".join(parts).lower()
     else:
+        # Sem tags o texto é só o nome: nada a montar. Um pré-filtro por 1º caractere
+        # dos patterns (set(nome)) saiu ~3x mais caro que o próprio "in" e não descarta
+        # nada na prática ("t"/"p" aparecem em quase todo nome de interface).
         text = (name or "").lower()
 
-    matches = {}
-    for p in patterns:
-        pl = p.lower()
-        matches[p] = (pl in text)
-    return matches
+    # Só os patterns que casaram (vazio na maioria dos itens): sem dict por item
+    return [p for p, pl in patterns_lower if pl in text]
+
+def process_host(host, host_map):
+    """Processa um host e devolve a saída já formatada (ordem estável entre threads)."""
+    out = io.StringIO()
+    print(f"\n==================== {host} ====================", file=out)
+    try:
+        if host not in host_map:
+            print("  Host não existe (nome difere do Zabbix).", file=out)
+            return out.getvalue()
+
+        items, raw = coletar_itens_iface_com_tags(host)
+        print(f"  Itens (interfaces in/out) encontrados: {len(items)}", file=out)
+        limite = ITEM_LIMIT * len(KEY_FAMILIES)
+        if len(items) >= limite:
+            print(f"  Aviso: atingiu o limite do item.get ({limite} = ITEM_LIMIT x famílias); "
+                  f"a lista pode estar truncada.", file=out)
+
+        if raw:
+            print("  Amostra RAW (key_ → name):", file=out)
+            for key_, nm in raw[:RAW_SHOW]:
+                print(f"    {key_}  ->  {nm}", file=out)
+            if len(raw) > RAW_SHOW:
+                print(f"    ... (+{len(raw)-RAW_SHOW} itens)", file=out)
+
+        if not items:
+            print("  Nenhum item retornado. Verifique template/LLD/SNMP.", file=out)
+            # ajuda extra: templates e interfaces já vieram no host.get inicial
+            hinfo = host_map[host]
+            tpl = hinfo.get("parentTemplates", [])
+            if tpl:
+                print("  Templates vinculados:", file=out)
+                for t in tpl:
+                    print(f"    - {t.get('name')}", file=out)
+            hifs = hinfo.get("interfaces", [])
+            if hifs:
+                print("  Interfaces do host (1=Agent,2=SNMP,3=IPMI,4=JMX):", file=out)
+                for i in hifs:
+                    print(f"    - type={i.get('type')} ip={i.get('ip')} dns={i.get('dns')} port={i.get('port')}", file=out)
+            return out.getvalue()
+
+        # Detalha primeiros itens (key, name, tags)
+        print("\n  Detalhe (amostra):", file=out)
+        for it in items[:MAX_SHOW]:
+            out.write(f"    ifIndex={it['_idx']:>4} | key={it.get('key_', '')}\n"
+                      f"       name: {it['_name']}\n"
+                      f"       tags: {tags_to_str(it['_tags'])}\n")
+
+        # Match por substring em NAME+TAGS
+        if LABEL_PATTERNS:
+            print("\n  Match por substrings (busca em NAME e TAGS):", file=out)
+            counters = {p: 0 for p in LABEL_PATTERNS}
+            examples = {p: [] for p in LABEL_PATTERNS}
+
+            for it in items:
+                name = it["_name"]
+                tags = it["_tags"]
+                for p in match_patterns(name, tags, LABEL_PATTERNS_LOWER):
+                    counters[p] += 1
+                    if VERBOSE and len(examples[p]) < 10:
+                        # guarda a tupla; formata só na impressão
+                        examples[p].append((it["_idx"], name, tags))
+
+            for p in LABEL_PATTERNS:
+                print(f'    "{p}": {counters[p]} item(ns) casando', file=out)
+                out.write("".join([f"       - {idx} → {nm} | {tags_to_str(tg)}\n"
+                                   for idx, nm, tg in examples[p]]))
+
+    except requests.exceptions.RequestException as e:
+        print(f"  Erro HTTP/Conexão: {e}", file=out)
+    except RuntimeError as e:
+        print(f"  Erro na API do Zabbix: {e}", file=out)
+    except Exception as e:
+        print(f"  Falha inesperada: {e}", file=out)
+    return out.getvalue()
 
 def main():
-    if not VERIFY_SSL:
-        try:
-            import urllib3
-            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-        except Exception:
-            pass
-
-    for host in HOSTS:
-        print(f"\n==================== {host} ====================")
-        try:
-            hh = api("host.get", {"output": ["hostid","host"], "filter": {"host": [host]}})
-            if not hh:
-                print("  Host não existe (nome difere do Zabbix).")
-                continue
-
-            items, raw = coletar_itens_iface_com_tags(host)
-            print(f"  Itens (interfaces in/out) encontrados: {len(items)}")
-
-            if raw:
-                print("  Amostra RAW (key_ → name):")
-                for key_, nm in raw[:RAW_SHOW]:
-                    print(f"    {key_}  ->  {nm}")
-                if len(raw) > RAW_SHOW:
-                    print(f"    ... (+{len(raw)-RAW_SHOW} itens)")
-
-            if not items:
-                print("  Nenhum item retornado. Verifique template/LLD/SNMP.")
-                # ajuda extra: mostrar templates e interfaces
-                try:
-                    info = api("host.get", {
-                        "output": ["hostid"],
-                        "selectParentTemplates": ["templateid","name"]
-                    })
-                    if info:
-                        tpl = info[0].get("parentTemplates", [])
-                        if tpl:
-                            print("  Templates vinculados:")
-                            for t in tpl:
-                                print(f"    - {t.get('name')}")
-                    hifs = api("hostinterface.get", {
-                        "output": ["type","useip","ip","dns","port","details"],
-                        "hostids": [hh[0]["hostid"]]
-                    })
-                    if hifs:
-                        print("  Interfaces do host (1=Agent,2=SNMP,3=IPMI,4=JMX):")
-                        for i in hifs:
-                            print(f"    - type={i.get('type')} ip={i.get('ip')} dns={i.get('dns')} port={i.get('port')}")
-                except Exception:
-                    pass
-                continue
-
-            # Detalha primeiros itens (key, name, tags)
-            print("\n  Detalhe (amostra):")
-            for it in items[:MAX_SHOW]:
-                key_ = it.get("key_", "")
-                name = it.get("name","")
-                tags = it.get("tags", [])
-                idx = idx_from_key(key_) or "-"
-                print(f"    ifIndex={idx:>4} | key={key_}")
-                print(f"       name: {name}")
-                print(f"       tags: {tags_to_str(tags)}")
-
-            # Match por substring em NAME+TAGS
-            if LABEL_PATTERNS:
-                print("\n  Match por substrings (busca em NAME e TAGS):")
-                counters = {p: 0 for p in LABEL_PATTERNS}
-                examples = {p: [] for p in LABEL_PATTERNS}
-
-                for it in items:
-                    name = it.get("name","")
-                    tags = it.get("tags", [])
-                    m = match_patterns(name, tags, LABEL_PATTERNS)
-                    for p, ok in m.items():
-                        if ok:
-                            counters[p] += 1
-                            if len(examples[p]) < 10:
-                                idx = idx_from_key(it.get("key_","")) or "-"
-                                examples[p].append(f"{idx} → {name} | {tags_to_str(tags)}")
-
-                for p in LABEL_PATTERNS:
-                    print(f'    "{p}": {counters[p]} item(ns) casando')
-                    for ex in examples[p]:
-                        print(f"       - {ex}")
-
-        except requests.exceptions.RequestException as e:
-            print(f"  Erro HTTP/Conexão: {e}")
-        except RuntimeError as e:
-            print(f"  Erro na API do Zabbix: {e}")
-        except Exception as e:
-            print(f"  Falha inesperada: {e}")
+    # Um único host.get resolve todos os HOSTS (existência + templates/interfaces p/ diagnóstico)
+    hosts_info = api("host.get", {
+        "output": ["hostid", "host"],
+        "filter": {"host": HOSTS},
+        "selectParentTemplates": ["templateid", "name"],
+        "selectInterfaces": ["type", "useip", "ip", "dns", "port", "details"],
+    })
+    host_map = {h["host"]: h for h in hosts_info}
+
+    # Hosts são independentes: consulta em paralelo e imprime na ordem de HOSTS
+    with ThreadPoolExecutor(max_workers=max(1, min(MAX_WORKERS, len(HOSTS)))) as ex:
+        for saida in ex.map(lambda h: process_host(h, host_map), HOSTS):
+            sys.stdout.write(saida)
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    except requests.exceptions.RequestException as e:
+        print(f"Erro HTTP/Conexão: {e}")
+    except RuntimeError as e:
+        print(f"Erro na API do Zabbix: {e}")
+    except Exception as e:
+        print(f"Falha inesperada: {e}")
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Helpers compartilhados pelos scripts de coleta (3-coleta-cabral.py,
+zabbix-send-received-95.py): período, API do Zabbix, trends, estatísticas e
+formatação.
+
+Cada script chama configure() no main() com o seu servidor/token; a SESSION
+(e o pool de conexões keep-alive) é única por processo.
+"""
+import math
+import time
+import requests
+from requests.adapters import HTTPAdapter
+try:
+    import orjson  # opcional: decodifica as respostas grandes de trend.get bem mais rápido
+except ImportError:
+    orjson = None
+from datetime import datetime, timedelta, timezone
+from calendar import monthrange
+from collections import defaultdict
+
+# =======================
+# Tempo
+# =======================
+def intervalo_mes_anterior_utc(now_utc: datetime):
+    ano = now_utc.year if now_utc.month > 1 else now_utc.year - 1
+    mes = now_utc.month - 1 if now_utc.month > 1 else 12
+    inicio = datetime(ano, mes, 1, 0, 0, 0, tzinfo=timezone.utc)
+    fim = datetime(ano, mes, monthrange(ano, mes)[1], 23, 59, 59, tzinfo=timezone.utc)
+    return int(inicio.timestamp()), int(fim.timestamp())
+
+def intervalo_ultimos_30_dias_utc(now_utc: datetime):
+    return int((now_utc - timedelta(days=30)).timestamp()), int(now_utc.timestamp())
+
+# =======================
+# API
+# =======================
+# Sessão única: reaproveita as conexões TCP/TLS entre chamadas (keep-alive)
+SESSION = requests.Session()
+_CONFIG = {"url": None, "token": None, "verify": True, "timeout": 60}
+
+def configure(url, token, verify=True, timeout=60, pool_size=8):
+    """
+    Define servidor/token usados por zabbix_api() e dimensiona o pool da SESSION.
+    Um só servidor -> um pool; pool_block faz a thread esperar uma conexão já
+    aberta em vez de criar (e descartar) conexões extras além de pool_size.
+    """
+    _CONFIG.update(url=url, token=token, verify=verify, timeout=timeout)
+    SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True))
+    if not verify:
+        try:
+            import urllib3
+            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        except Exception:
+            pass
+
+def zabbix_api(method, params):
+    payload = {"jsonrpc": "2.0", "method": method, "params": params, "auth": _CONFIG["token"], "id": 1}
+    r = SESSION.post(_CONFIG["url"], json=payload, verify=_CONFIG["verify"], timeout=_CONFIG["timeout"])
+    r.raise_for_status()
+    j = orjson.loads(r.content) if orjson else r.json()
+    if "error" in j:
+        raise RuntimeError(j["error"])
+    return j["result"]
+
+# =======================
+# Trends / estatísticas
+# =======================
+def percentile(values, p):
+    if not values:
+        return None
+    # sorted() (timsort em C) ainda vence seleção em Python puro (heapq) p/ ~720 buckets
+    vals = sorted(values)
+    k = (len(vals) - 1) * (p / 100.0)
+    f = int(k)
+    c = min(f + 1, len(vals) - 1)
+    if f == c:
+        return vals[f]
+    return vals[f] + (vals[c] - vals[f]) * (k - f)
+
+def percentile_nearest(values, p):
+    """Percentil nearest-rank (sem interpolação): o valor na posição ceil(p% * n)."""
+    if not values:
+        return None
+    n = len(values)
+    k = max(0, min(n - 1, math.ceil(p / 100.0 * n) - 1))
+    return sorted(values)[k]
+
+def fetch_trends_bulk(itemids, t_from, t_till):
+    """Uma única trend.get para todos os itens; retorna { itemid: [buckets] }."""
+    itemids = list(itemids)
+    if not itemids:
+        # Nenhum item resolvido: nada a buscar, evita a ida ao servidor
+        return {}
+    trends = zabbix_api("trend.get", {
+        "output": ["itemid", "clock", "num", "value_avg", "value_min", "value_max"],
+        "itemids": itemids,
+        "time_from": t_from,
+        "time_till": t_till,
+        "sortfield": "clock",
+        "sortorder": "ASC",
+    })
+    by_item = defaultdict(list)
+    for t in trends:
+        by_item[t["itemid"]].append(t)
+    return by_item
+
+def aggregate_trends(buckets, with_p95=True, exact_p95=False):
+    """
+    Passada única pelos buckets com num>0 -> { media, min, max, p95, total_bytes }.
+    p95 nearest-rank por padrão; exact_p95=True usa o percentil interpolado.
+    Retorna None se não houver buckets com dados.
+    """
+    avgs = []
+    soma = 0.0
+    amin = math.inf
+    amax = -math.inf
+    for t in buckets:
+        if int(t.get("num", 0)) > 0:
+            v = float(t["value_avg"])  # bits/s
+            avgs.append(v)
+            soma += v
+            vmin = float(t["value_min"])
+            if vmin < amin:
+                amin = vmin
+            vmax = float(t["value_max"])
+            if vmax > amax:
+                amax = vmax
+    if not avgs:
+        return None
+    return {
+        "media": soma / len(avgs),
+        "min": amin,
+        "max": amax,
+        "p95": (percentile if exact_p95 else percentile_nearest)(avgs, 95.0) if with_p95 else None,
+        "total_bytes": soma * 3600.0 / 8.0,  # somatório por bucket de 1h, em bytes
+    }
+
+# =======================
+# Formatação
+# =======================
+_UNITS = ("bps", "Kbps", "Mbps", "Gbps", "Tbps")
+
+def format_bps(bps: float) -> str:
+    # Divisão sucessiva (no máx. 4 voltas): mesma unidade/arredondamento do laço
+    # original nas fronteiras de 1000^n e sem exceção para inf/nan
+    v = float(bps)
+    i = 0
+    while v >= 1000 and i < len(_UNITS) - 1:
+        v /= 1000.0
+        i += 1
+    return f"{v:.2f} {_UNITS[i]}"
+
+def format_total_bytes(num_bytes: float) -> str:
+    gb = num_bytes / (1024 ** 3)
+    if gb >= 1024:
+        return f"{gb/1024:.2f} TB"
+    return f"{gb:.2f} GB"
+
+def format_utc(ts: int) -> str:
+    """Timestamp -> 'AAAA-MM-DD HH:MM:SS' (UTC) direto em C, sem criar datetime."""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(ts))